@@ -1,80 +1,189 @@
 import polars as pl
-import pandas as pd
+import numpy as np
+import hashlib
 import io
+import os
+import tempfile
+import streamlit as st
 
 
-def load_csv_data(uploaded_file):
-    """Load CSV data using Polars"""
+def _hash_plan(lf: pl.LazyFrame):
+    """Cache key for a lazy plan: its unoptimized query text, including the scanned file"""
+    return lf.explain(optimized=False)
+
+
+FRAME_HASH_FUNCS = {pl.LazyFrame: _hash_plan}
+
+
+# Parquet copies of uploaded files, keyed by content hash, survive app restarts
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rfi_app")
+
+
+def get_file_key(file_bytes: bytes):
+    """Fast content hash of an uploaded file, used as its cache key"""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def _scan_csv_upload(file_key: str, _file_bytes: bytes):
+    """Parquet-backed lazy scan of an uploaded CSV; raises on failure so errors are never cached"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    parquet_path = os.path.join(CACHE_DIR, f"{file_key}.parquet")
+    
+    # Parse the CSV only the first time this content is seen
+    if not os.path.exists(parquet_path):
+        # scan_csv needs a path, so spill the uploaded bytes to a temporary file
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp:
+            tmp.write(_file_bytes)
+        try:
+            # Stream the parse from disk with bounded memory, without a final rechunk;
+            # write under a temporary name so an interrupted run leaves no partial file
+            pl.scan_csv(tmp.name, try_parse_dates=True, rechunk=False).sink_parquet(parquet_path + ".tmp")
+            os.replace(parquet_path + ".tmp", parquet_path)
+        finally:
+            os.unlink(tmp.name)
+            if os.path.exists(parquet_path + ".tmp"):
+                os.unlink(parquet_path + ".tmp")
+    
+    # Build a lazy scan; nothing is read until a query is collected
+    return pl.scan_parquet(parquet_path)
+
+
+def load_csv_data(file_key: str, file_bytes: bytes):
+    """Load CSV data as a Polars LazyFrame backed by a Parquet copy on disk"""
     try:
-        # Read the uploaded file as bytes and convert to string
-        bytes_data = uploaded_file.getvalue()
-        string_data = bytes_data.decode('utf-8')
-        
-        # Use Polars to read CSV from string
-        df = pl.read_csv(io.StringIO(string_data))
-        return df, None
+        lf = _scan_csv_upload(file_key, file_bytes)
+        return lf, None
+    except Exception as e:
+        return None, str(e)
+
+
+@st.cache_resource(show_spinner=False)
+def _scan_parquet_upload(file_key: str, _file_bytes: bytes):
+    """Lazy scan of an uploaded Parquet file; raises on failure so errors are never cached"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    parquet_path = os.path.join(CACHE_DIR, f"{file_key}.parquet")
+    
+    # Already columnar: store the uploaded bytes as-is, no parsing needed
+    if not os.path.exists(parquet_path):
+        try:
+            with open(parquet_path + ".tmp", "wb") as f:
+                f.write(_file_bytes)
+            # Check the footer and schema first so an invalid upload is never kept in the cache
+            pl.read_parquet_schema(parquet_path + ".tmp")
+            os.replace(parquet_path + ".tmp", parquet_path)
+        finally:
+            if os.path.exists(parquet_path + ".tmp"):
+                os.unlink(parquet_path + ".tmp")
+    
+    return pl.scan_parquet(parquet_path)
+
+
+def load_parquet_data(file_key: str, file_bytes: bytes):
+    """Load Parquet data as a Polars LazyFrame"""
+    try:
+        lf = _scan_parquet_upload(file_key, file_bytes)
+        return lf, None
     except Exception as e:
         return None, str(e)
 
 
-def get_data_info(df: pl.DataFrame):
+def _date_expr(lf: pl.LazyFrame):
+    """Expression for the 'Date' column as pl.Date, parsing it only if it is still text"""
+    dtype = lf.schema['Date']
+    if dtype == pl.Date:
+        return pl.col('Date')
+    if dtype == pl.Utf8:
+        return pl.col('Date').str.to_datetime().dt.date()
+    return pl.col('Date').dt.date()
+
+
+@st.cache_data(show_spinner=False, hash_funcs=FRAME_HASH_FUNCS)
+def get_data_info(lf: pl.LazyFrame):
     """Get basic information about the dataset"""
     try:
-        # Convert Date column to datetime for analysis
-        df_temp = df.with_columns(pl.col('Date').str.to_datetime().dt.date())
+        # Compute all aggregates in a single query
+        date = _date_expr(lf)
+        summary = lf.select(
+            pl.count().alias('rows'),
+            date.min().alias('min_date'),
+            date.max().alias('max_date'),
+            date.n_unique().alias('unique_dates'),
+            pl.col('ID_Cust').n_unique().alias('unique_users')
+        ).collect().row(0, named=True)
         
         info = {
-            'shape': df.shape,
-            'date_range': (df_temp['Date'].min(), df_temp['Date'].max()),
-            'unique_dates': df_temp['Date'].n_unique(),
-            'unique_users': df['ID_Cust'].n_unique()
+            'shape': (summary['rows'], len(lf.columns)),
+            'date_range': (summary['min_date'], summary['max_date']),
+            'unique_dates': summary['unique_dates'],
+            'unique_users': summary['unique_users']
         }
         return info, None
     except Exception as e:
         return None, str(e)
 
 
-def data_cleaning_pipeline(df: pl.DataFrame):
-    """Data cleaning pipeline from the notebook"""
+@st.cache_data(show_spinner=False, hash_funcs=FRAME_HASH_FUNCS)
+def is_date_sorted(lf: pl.LazyFrame):
+    """Check whether the 'Date' column is already in ascending order (one pass over that column)"""
+    return lf.select((pl.col('Date').diff() >= 0).all()).collect().item()
+
+
+def data_cleaning_pipeline(lf: pl.LazyFrame):
+    """Data cleaning pipeline from the notebook, appended to the lazy plan"""
     try:
-        # Convert 'Date' column to datetime
-        df = df.with_columns(pl.col('Date').str.to_datetime().dt.date())
+        # Convert 'Date' column to date (a no-op when the CSV reader already parsed it)
+        lf = lf.with_columns(_date_expr(lf))
 
         # Remove duplicates based on 'ID_Cust' and 'Date'
-        df = df.unique(subset=['ID_Cust', 'Date'])
-
-        # Check if dates are ordered
-        is_ordered = df['Date'].is_sorted()
-        if not is_ordered:
-            df = df.sort(['Date', 'ID_Cust'])
+        if is_date_sorted(lf):
+            # Chronological input (the common case): keep its order through unique() and skip the sort
+            lf = lf.set_sorted('Date').unique(subset=['ID_Cust', 'Date'], keep='first', maintain_order=True)
+        else:
+            # unique() does not keep row order, so order by date
+            lf = lf.unique(subset=['ID_Cust', 'Date']).sort(['Date', 'ID_Cust'])
 
-        return df, None
+        return lf, None
     except Exception as e:
         return None, str(e)
 
 
-def get_cleaning_stats(original_df: pl.DataFrame, cleaned_df: pl.DataFrame):
+@st.cache_data(show_spinner=False, hash_funcs=FRAME_HASH_FUNCS)
+def get_cleaning_stats(original_lf: pl.LazyFrame, cleaned_lf: pl.LazyFrame):
     """Get statistics after cleaning"""
     try:
-        reduction_percentage = round((original_df.shape[0] - cleaned_df.shape[0]) / original_df.shape[0] * 100, 1)
+        original, cleaned = pl.collect_all([
+            original_lf.select(pl.count().alias('rows')),
+            cleaned_lf.select(
+                pl.count().alias('rows'),
+                pl.col('Date').min().alias('min_date'),
+                pl.col('Date').max().alias('max_date'),
+                pl.col('Date').n_unique().alias('unique_dates'),
+                pl.col('ID_Cust').n_unique().alias('unique_users')
+            )
+        ])
+        original_rows = original['rows'][0]
+        cleaned = cleaned.row(0, named=True)
+        
+        reduction_percentage = round((original_rows - cleaned['rows']) / original_rows * 100, 1)
         
         stats = {
-            'new_shape': cleaned_df.shape,
+            'new_shape': (cleaned['rows'], len(cleaned_lf.columns)),
             'reduction_percentage': reduction_percentage,
-            'date_range': (cleaned_df['Date'].min(), cleaned_df['Date'].max()),
-            'unique_dates': cleaned_df['Date'].n_unique(),
-            'unique_users': cleaned_df['ID_Cust'].n_unique()
+            'date_range': (cleaned['min_date'], cleaned['max_date']),
+            'unique_dates': cleaned['unique_dates'],
+            'unique_users': cleaned['unique_users']
         }
         return stats, None
     except Exception as e:
         return None, str(e)
 
 
-def transform_to_pivot(df: pl.DataFrame):
+def transform_to_pivot(lf: pl.LazyFrame):
     """Transform data to pivot table"""
     try:
-        # Add Active column
-        data = df.with_columns(pl.lit(1).alias("Active"))
+        # Add Active column and materialize the cleaned plan (pivot is eager-only)
+        data = lf.with_columns(pl.lit(1).alias("Active")).collect()
 
         # Create pivot table
         pivot_table = data.pivot(
@@ -92,40 +201,38 @@ def transform_to_pivot(df: pl.DataFrame):
         return None, str(e)
 
 
-def longest_inactivity_streak(row):
-    """Compute longest inactivity streak per user"""
-    inactive_str = "".join(map(str, row))  # Convert row to string of 1s and 0s
-    return max(map(len, inactive_str.split("1"))) if "0" in inactive_str else 0
-
-
-def analyze_dropout_clients(pivot_df: pl.DataFrame):
-    """Analyze dropout and 100% active clients"""
+@st.cache_data(show_spinner=False, hash_funcs=FRAME_HASH_FUNCS)
+def analyze_dropout_from_long(lf: pl.LazyFrame):
+    """Analyze dropout and 100% active clients from the cleaned (long) data, without a pivot"""
     try:
-        # Convert to pandas for the streak calculation (as in original notebook)
-        pivot_pandas = pivot_df.to_pandas()
-        
-        # Calculate longest inactivity streak
-        pivot_pandas["Longest_Inactivity_Streak"] = pivot_pandas.apply(longest_inactivity_streak, axis=1)
+        # Index of each date among all distinct dates, i.e. its column in the pivot table
+        days = lf.select(
+            'ID_Cust',
+            (pl.col('Date').rank('dense') - 1).cast(pl.Int64).alias('Day'),
+            pl.col('Date').n_unique().alias('Total_Days')
+        )
         
-        # Identify different client types
-        dropout_clients = len(pivot_pandas[(pivot_pandas["Longest_Inactivity_Streak"] >= 120)])
+        # Longest inactivity streak: the largest gap before the first, between two
+        # consecutive, or after the last active day of each user
+        streaks = days.group_by('ID_Cust').agg(
+            pl.max_horizontal(
+                pl.col('Day').min(),
+                (pl.col('Day').sort().diff() - 1).max(),
+                pl.col('Total_Days').first() - 1 - pl.col('Day').max()
+            ).alias('Longest_Inactivity_Streak')
+        ).sort('ID_Cust').collect()
         
-        active_100_clients = len(pivot_pandas[pivot_pandas["Longest_Inactivity_Streak"] == 0])
+        longest_streak = streaks['Longest_Inactivity_Streak']
         
-        total_clients = len(pivot_pandas)
-        
-        # Get indices to drop (dropout clients)
-        to_drop_indices = pivot_pandas[
-            (pivot_pandas["Longest_Inactivity_Streak"] >= 120) | 
-            (pivot_pandas["Longest_Inactivity_Streak"] == 0)
-        ].index.tolist()
+        # Rows follow the pivot table order (sorted by ID_Cust), so the mask lines up with it
+        keep_mask = longest_streak.is_between(1, 119)
         
         stats = {
-            'total_clients': total_clients,
-            'dropout_clients': dropout_clients,
-            'active_100_clients': active_100_clients,
-            'to_drop_indices': to_drop_indices,
-            'streaks_df': pivot_pandas[["Longest_Inactivity_Streak"]]
+            'total_clients': streaks.height,
+            'dropout_clients': (longest_streak >= 120).sum(),
+            'active_100_clients': (longest_streak == 0).sum(),
+            'keep_mask': keep_mask,
+            'streaks_df': streaks.select('Longest_Inactivity_Streak').to_pandas()
         }
         
         return stats, None
@@ -133,33 +240,41 @@ def analyze_dropout_clients(pivot_df: pl.DataFrame):
         return None, str(e)
 
 
-def filter_clients(pivot_df: pl.DataFrame, to_drop_indices: list):
+def filter_clients(pivot_df: pl.DataFrame, keep_mask: pl.Series):
     """Filter out dropout clients"""
     try:
-        # Convert to pandas for filtering (to match notebook logic)
-        pivot_pandas = pivot_df.to_pandas()
-        
-        # Filter out the clients
-        filtered_df = pivot_pandas[~pivot_pandas.index.isin(to_drop_indices)]
+        # Boolean row predicate evaluated by Polars, no index list or pandas copy
+        filtered_df = pivot_df.filter(keep_mask)
         
-        # Convert back to polars
-        filtered_polars = pl.DataFrame(filtered_df)
-        
-        return filtered_polars, None
+        return filtered_df, None
     except Exception as e:
         return None, str(e)
 
 
+def get_observation_array(df: pl.DataFrame):
+    """Get the observation period (first 180 days) as a contiguous uint8 array"""
+    first_period_duration = 180
+    return np.ascontiguousarray(df[:, :first_period_duration].to_numpy().astype(np.uint8))
+
+
 def save_to_csv(df, filename="cleaned_filtered_data.csv"):
-    """Convert polars DataFrame to CSV string for download"""
+    """Write a polars (or pandas) DataFrame to CSV bytes for download"""
     try:
-        if isinstance(df, pl.DataFrame):
-            # Convert to pandas for CSV export
-            pandas_df = df.to_pandas()
-            csv_string = pandas_df.to_csv(index=False)
-        else:
-            # Already pandas
-            csv_string = df.to_csv(index=False)
-        return csv_string, None
+        # Pandas input (rare) goes through polars too, for the multithreaded native writer
+        if not isinstance(df, pl.DataFrame):
+            df = pl.from_pandas(df)
+        buf = io.BytesIO()
+        df.write_csv(buf)
+        return buf.getvalue(), None
+    except Exception as e:
+        return None, str(e)
+
+
+def save_to_parquet(df: pl.DataFrame):
+    """Write a polars DataFrame to Parquet bytes for download"""
+    try:
+        buf = io.BytesIO()
+        df.write_parquet(buf, compression="zstd", statistics=True)
+        return buf.getvalue(), None
     except Exception as e:
         return None, str(e)
\ No newline at end of file
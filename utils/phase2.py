@@ -0,0 +1,137 @@
+import streamlit as st
+import polars as pl
+import polars.selectors as cs
+import time
+import io
+from utils.data_processing import get_file_key, load_csv_data, load_parquet_data, get_observation_array
+
+
+def render_individual_user_analysis(filtered_df):
+    """Render the individual user RFI analysis section."""
+    st.subheader("Process RFI Matrix for Individual Users")
+    
+    user_id = st.number_input(
+        "Enter User ID for RFI Analysis:",
+        min_value=0,
+        max_value=st.session_state.n_users-1,
+        value=0
+    )
+    
+    if st.button("Calculate RFI Matrix"):
+        # Deferred so the Numba kernels load only once an analysis is requested
+        from utils.rfi_analysis import get_rfi_matrix, calculate_dormancy, get_user_row
+        
+        rfi_matrix, features = get_rfi_matrix(filtered_df.row(user_id))
+
+        # Calculate 6 months dormancy (observation period only)
+        dormancy_value = calculate_dormancy(get_user_row(st.session_state.obs_arr, user_id))
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.subheader("RFI Matrix")
+            st.dataframe(rfi_matrix.to_arrow())
+
+            st.subheader("6 Months Dormancy")
+            st.metric(
+                label="Dormancy Value (Observation Period : First 180 Days only)", 
+                value=int(dormancy_value)
+            )
+            
+        with col2:
+            st.subheader("User Features")
+            feature_names = [
+                "Activity Ratio", "Num Episodes", "Avg Recency", "Min Recency",
+                "Avg Relevance", "Max Relevance", "Activity Periodicity Score",
+                "Inactivity Linearity", "Activity Variability", 
+                "Inactivity Growth Rate", "Recent Activity Density"
+            ]
+            
+            features_df = pl.DataFrame({
+                "Feature": feature_names,
+                "Value": features
+            })
+            st.dataframe(features_df.to_arrow())
+
+
+def render_process_all_users(filtered_df):
+    """Render the process all users section."""
+    st.subheader("Processing All Users")
+
+    if st.button("Process All Users"):
+        from utils.rfi_analysis import calculate_batch_features
+        
+        start_time = time.time()
+        total_users = st.session_state.n_users
+        
+        # Calculate features and dormancy for all users in one vectorized pass
+        with st.spinner(f"Processing {total_users} users..."):
+            final_df = calculate_batch_features(st.session_state.obs_arr)
+    
+        total_time = time.time() - start_time
+        st.success(f"✅ Processing completed! Total time: {total_time:.2f} seconds | Users processed: {total_users}")
+    
+        # Display results
+        st.subheader("Results Summary")
+        final_df = final_df.with_columns(cs.float().round(2))
+        st.dataframe(final_df.head().to_arrow())
+    
+        # Download button
+        buf = io.BytesIO()
+        final_df.write_csv(buf)
+        csv_data = buf.getvalue()
+        st.download_button(
+            label="📥 Download Full Results as CSV",
+            data=csv_data,
+            file_name="user_analysis_results.csv",
+            mime="text/csv",
+            key="download_results"
+        )
+        st.session_state.processed_all_users = True
+
+
+def render_rfi_analysis_section(filtered_df):
+    """Render the complete RFI analysis section with both individual and batch processing."""
+    st.markdown("---")
+    render_individual_user_analysis(filtered_df)
+    
+    st.markdown("---")
+    render_process_all_users(filtered_df)
+
+
+def get_filtered_dataframe():
+    """Get the filtered DataFrame from session state or file upload."""
+    # Check if we already have filtered data from Phase 1
+    if st.session_state.data_filtered and 'filtered_df' in st.session_state:
+        return st.session_state.filtered_df
+    
+    # If not, prompt for file upload
+    st.info("Please upload a filtered dataset (pivot table structure: users as rows, dates as columns)")
+    uploaded_filtered_file = st.file_uploader("Choose a filtered CSV or Parquet file", type=["csv", "parquet"], key="rfi_upload")
+    
+    if uploaded_filtered_file is not None:
+        if st.button("Upload Filtered Data"):
+            with st.spinner("Loading filtered data..."):
+                file_bytes = uploaded_filtered_file.getvalue()
+                if uploaded_filtered_file.name.endswith(".parquet"):
+                    filtered_plan, error = load_parquet_data(get_file_key(file_bytes), file_bytes)
+                else:
+                    filtered_plan, error = load_csv_data(get_file_key(file_bytes), file_bytes)
+                
+                if error:
+                    st.error(f"Error loading data: {error}")
+                    return None
+                else:
+                    # Phase 2 works on the full pivot, so materialize it once here
+                    filtered_df = filtered_plan.collect()
+                    st.session_state.uploaded_filtered_df = filtered_df
+                    st.session_state.obs_arr = get_observation_array(filtered_df)
+                    st.session_state.n_users = filtered_df.shape[0]
+                    st.success("Filtered data uploaded successfully!")
+                    return filtered_df
+    
+    # Return uploaded data if it exists in session state
+    if 'uploaded_filtered_df' in st.session_state:
+        return st.session_state.uploaded_filtered_df
+    
+    return None
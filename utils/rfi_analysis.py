@@ -1,10 +1,48 @@
 import polars as pl
 import numpy as np
-from scipy import stats
-
-def get_rfi_matrix(df, user_id):
-
-    activity = df.row(user_id)
+from utils.rfi_kernels import compute_features, compute_row_features, find_episodes, pack_activity
+
+# Rows per FFT block, bounding the complex spectrum to a few hundred MB on a year of days
+PERIODICITY_BLOCK_ROWS = 8192
+
+
+def activity_periodicity_scores(activity):
+    """Activity periodicity score of every row of an activity matrix, from blocked FFT autocorrelations"""
+    n_users = activity.shape[0]
+    n_obs = activity.shape[1] - 1
+    # Observation days exclude the reference day, extended by one inactive day if inactive today
+    lengths = n_obs + (activity[:, -1] == 0)
+
+    scores = np.zeros(n_users)
+    if n_obs + 1 <= 7:  # Need more than 7 observation days
+        return scores
+
+    n_lags = min(30, n_obs + 1)
+    lags = np.arange(n_lags)
+    for start in range(0, n_users, PERIODICITY_BLOCK_ROWS):
+        stop = min(start + PERIODICITY_BLOCK_ROWS, n_users)
+
+        # Autocorrelation over non-negative lags via a zero-padded real FFT (no circular wrap);
+        # the exact values are integers, so rounding removes the FFT noise
+        observation_days = activity[start:stop, :-1].astype(np.float64)
+        spectrum = np.fft.rfft(observation_days, n=2 * n_obs, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        del spectrum
+        autocorr = np.rint(np.fft.irfft(power, n=2 * n_obs, axis=1)[:, :n_lags])
+
+        # Normalize by the zero-lag peak and average the lags 1..29 (fewer for short observations)
+        block_lengths = lengths[start:stop]
+        valid = (block_lengths > 7) & (autocorr[:, 0] > 0)  # Need data and some activity
+        normalized = autocorr[valid] / autocorr[valid, :1]
+        in_window = (lags >= 1) & (lags < np.minimum(30, block_lengths[valid])[:, np.newaxis])
+        block_scores = np.where(in_window, normalized, 0).sum(axis=1) / np.minimum(29, block_lengths[valid] - 1)
+        scores[start:stop][valid] = block_scores
+    return scores
+
+
+def get_rfi_arrays(activity, include_features=True, periodicity_score=None):
+    """Decompose a 1-D activity row into RFI matrix columns (NumPy arrays) and, optionally, its features"""
+    activity = np.asarray(activity)
     reference_day = activity[-1]
     observation_days = activity[:-1]
 
@@ -12,216 +50,91 @@ def get_rfi_matrix(df, user_id):
     if reference_day == 0:
         observation_days = np.append(observation_days, 0)
 
-    episodes = []
-    i = 0
-    while i < len(observation_days):
-        if observation_days[i] == 0:
-            start = i
-            while i < len(observation_days) and observation_days[i] == 0:
-                i += 1
-            duration = i - start
-            episodes.append((start, duration))
-        else:
-            i += 1
-
+    # Runs of inactive days as parallel start/duration arrays
+    starts, durations = find_episodes(observation_days)
 
     # Separate ongoing inactivity episode if exists
     ongoing_episode = None
-    if episodes:
-        last_start, last_duration = episodes[-1]
-        last_end = last_start + last_duration - 1
+    if len(durations):
+        last_end = starts[-1] + durations[-1] - 1
         if reference_day == 0 and last_end == len(observation_days) - 1:
-            ongoing_episode = (last_start, last_duration)
-            episodes = episodes[:-1]  # remove ongoing from previous episodes
-
-    rfi_data = {}
-
-    # Process previous episodes
-    for start, duration in episodes:
-        last_day_of_episode = start + duration - 1
-        recency = len(observation_days) - last_day_of_episode - (1 if reference_day == 0 else 0)
-
-        if duration not in rfi_data:
-            rfi_data[duration] = {'F': 1, 'R': recency}
-        else:
-            rfi_data[duration]['F'] += 1
-            rfi_data[duration]['R'] = min(rfi_data[duration]['R'], recency)
-
-    # Prepare rows including ongoing episode separately
-    rfi_rows = [
-        {'I': duration, 'F': data['F'], 'R': data['R']}
-        for duration, data in rfi_data.items()
-    ]
+            ongoing_episode = (starts[-1], durations[-1])
+            # remove ongoing from previous episodes
+            starts, durations = starts[:-1], durations[:-1]
+
+    # Recency of each previous episode
+    recencies = len(observation_days) - (starts + durations - 1) - (1 if reference_day == 0 else 0)
+
+    # One RFI row per distinct duration: frequency and most recent occurrence
+    I, episode_row = np.unique(durations, return_inverse=True)
+    F = np.bincount(episode_row, minlength=len(I))
+    R = np.full(len(I), len(observation_days), dtype=np.int64)
+    np.minimum.at(R, episode_row, recencies)
 
+    # Ongoing episode is kept as its own row
     if ongoing_episode:
-        dur = ongoing_episode[1]
-        rfi_rows.append({'I': dur, 'F': 1, 'R': 0})
+        I = np.append(I, ongoing_episode[1])
+        F = np.append(F, 1)
+        R = np.append(R, 0)
 
-    rfi_df = pl.DataFrame(rfi_rows)
+    # Calculate Relevance
+    #k = 0.1
+    k = 1 / 30
 
+    relevance = np.round(I * F * np.exp(-k * np.sqrt(R + 1)) * ((R < 90) & (R != 0)), 2)
 
+    order = np.argsort(R, kind='stable')
+    rfi = {'R': R[order], 'F': F[order], 'I': I[order], 'Relevance': relevance[order]}
 
-    # Handle case where no inactivity episodes are found
-    if rfi_df.is_empty():
-        total_days = len(observation_days)
-        active_days = np.sum(observation_days)
-        activity_ratio = active_days / total_days if total_days else 0
+    if not include_features:
+        return rfi, None
 
-        features = (
-            activity_ratio,
-            0,  # num_episodes
-            0,  # avg_recency
-            0,  # min_recency
-            0,  # avg_relevance
-            0,  # max_relevance
-            0,  # activity_periodicity_score
-            0,  # inactivity_linearity
-            0,  # activity_variability
-            0,  # inactivity_growth_rate
-            0   # recent_activity_density
-        )
-        return pl.DataFrame(schema={'R': pl.Int64, 'F': pl.Int64, 'I': pl.Int64, 'Relevance': pl.Float64}), features
+    # Features from the same single-scan kernel used for all users
+    if periodicity_score is None:
+        periodicity_score = activity_periodicity_scores(activity[np.newaxis, :])[0]
+    features, _ = compute_row_features(activity[np.newaxis, :], np.array([periodicity_score]), activity.shape[0])
+    features = features[0]
 
-    # Features
-    total_days = len(observation_days)
-    active_days = np.sum(observation_days)
+    return rfi, tuple(features.tolist())
 
-    activity_ratio = active_days / total_days if total_days else 0
-    num_episodes = rfi_df['F'].sum()
 
-    avg_recency = rfi_df['R'].mean() if num_episodes else 0
-    min_recency = rfi_df['R'].min() if num_episodes else 0
+def get_rfi_matrix(activity, include_features=True):
+    """Get the RFI matrix of a 1-D activity row as a DataFrame, with its features"""
+    rfi, features = get_rfi_arrays(activity, include_features)
+    return pl.DataFrame(rfi, schema={'R': pl.Int64, 'F': pl.Int64, 'I': pl.Int64, 'Relevance': pl.Float64}), features
 
-    # Calculate Relevance
-    #k = 0.1
-    k = 1 / 30
 
-    rfi_df = rfi_df.with_columns(
-        (pl.col("I") * pl.col("F") *
-        np.exp(-k * np.sqrt(pl.col("R") + 1)) *
-        (pl.col("R") < 90).cast(pl.Int32) *
-        (pl.col("R") != 0).cast(pl.Int32)).round(2).alias("Relevance")
-    )
+def get_user_row(obs_arr, user_id):
+    """Get the observation period activity of a single user"""
+    return obs_arr[user_id]
 
-    avg_relevance = rfi_df['Relevance'].mean() if num_episodes else 0
-    max_relevance = rfi_df['Relevance'].max() if num_episodes else 0
 
-    # Ensure observation_days is at least 1D for all operations
-    observation_days = np.atleast_1d(observation_days)
-    
-    # New Feature 1: Activity Periodicity Score
-    # Calculate autocorrelation to detect periodicity in activity patterns
-    if len(observation_days) > 7 and np.sum(observation_days) > 0:  # Need data and some activity
-        try:
-            autocorr = np.correlate(observation_days, observation_days, mode='full')
-            # Take the center part (positive lags)
-            autocorr = autocorr[len(autocorr)//2:]
-            # Normalize only if max > 0
-            if np.max(autocorr) > 0:
-                autocorr = autocorr / np.max(autocorr)
-                # Calculate periodicity as the sum of non-zero lag correlations
-                activity_periodicity_score = np.sum(autocorr[1:min(30, len(autocorr))]) / min(29, len(autocorr)-1)
-            else:
-                activity_periodicity_score = 0
-        except:
-            activity_periodicity_score = 0
-    else:
-        activity_periodicity_score = 0
-
-    # New Feature 2: Inactivity Linearity (R² Score)
-    # Calculate how well inactivity durations correlate with recency values for individual episodes
-    if len(episodes) > 1:
-        try:
-            individual_I_values = []
-            individual_R_values = []
-
-            for start, duration in episodes:
-                last_day_of_episode = start + duration - 1
-                recency = len(observation_days) - last_day_of_episode - (1 if reference_day == 0 else 0)
-                individual_I_values.append(duration)
-                individual_R_values.append(recency)
-
-            # Check for variance before regression
-            if len(set(individual_R_values)) > 1 and len(set(individual_I_values)) > 1:
-                _, _, r_value, _, _ = stats.linregress(individual_R_values, individual_I_values)
-                inactivity_linearity = r_value ** 2  # R² score
-            else:
-                inactivity_linearity = 0
-        except:
-            inactivity_linearity = 0
-    else:
-        inactivity_linearity = 0
-
-    # New Feature 3: Activity Variability
-    # Measure variation in gap between active days
-    active_indices = np.where(observation_days == 1)[0]
-    if len(active_indices) > 1:
-        gaps = np.diff(active_indices)
-        activity_variability = np.std(gaps) if len(gaps) > 0 else 0
-    else:
-        activity_variability = 0
-
-    # New Feature 4: Inactivity Growth Rate
-    # Rate at which inactivity duration increases from one episode to the next
-    if len(episodes) > 1:
-        try:
-            episode_durations = [duration for _, duration in episodes]
-            growth_rates = [episode_durations[i]/episode_durations[i-1] if episode_durations[i-1] > 0 else 1
-                             for i in range(1, len(episode_durations))]
-            inactivity_growth_rate = np.mean(growth_rates) if growth_rates else 1
-        except:
-            inactivity_growth_rate = 1
-    else:
-        inactivity_growth_rate = 1
-
-    # New Feature 5: Recent Activity Density
-    # Proportion of active days in the most recent 30-day period
-    recent_window = min(30, len(observation_days))
-    if recent_window > 0:
-        recent_days = observation_days[-recent_window:]
-        recent_activity_density = np.sum(recent_days) / recent_window
-    else:
-        recent_activity_density = 0
-
-    features = (
-        activity_ratio,
-        num_episodes,
-        avg_recency,
-        min_recency,
-        avg_relevance,
-        max_relevance,
-        activity_periodicity_score,
-        inactivity_linearity,
-        activity_variability,
-        inactivity_growth_rate,
-        recent_activity_density
-    )
-
-    return rfi_df.sort('R').select(['R', 'F', 'I', 'Relevance']), features
-
-
-def calculate_dormancy(observation_df, user_id):
+def calculate_dormancy(observation_row):
     """Calculate 6 months dormancy for an individual user"""
-    rfi_matrix, _ = get_rfi_matrix(observation_df, user_id)
-    
-    if not rfi_matrix.is_empty() and rfi_matrix["Relevance"].sum() > 0:
-        weighted_avg_dormancy = np.average(rfi_matrix["I"], weights=rfi_matrix["Relevance"])
-    else:
-        weighted_avg_dormancy = 0
-    
-    return round(weighted_avg_dormancy, 0)
+    _, _, dormancy = compute_features(pack_activity(observation_row[np.newaxis, :]), observation_row.shape[0])
+    return dormancy[0]
+
+
+def calculate_batch_features(obs_arr):
+    """Calculate activity ratio, inactivity linearity and dormancy for all users at once"""
+    # Bit-pack the days (24 bytes per user for 180 days) so the kernel works on whole words
+    packed = pack_activity(obs_arr)
+    activity_ratio, inactivity_linearity, dormancy = compute_features(packed, obs_arr.shape[1])
+
+    return pl.DataFrame({
+        "User ID": np.arange(obs_arr.shape[0]),
+        "Activity Ratio": activity_ratio,
+        "Inactivity Linearity": inactivity_linearity,
+        "6 Months Dormancy": dormancy.astype(np.int64)
+    })
+
 
 def process_all_users(df):
     """Process all users and calculate features and dormancy"""
     first_period_duration = 180
-    second_period_duration = 187
-    
-    observation_df = df.select(df.columns[:first_period_duration])
-    test_df = df.select(df.columns[-second_period_duration:])
-
     
-    print("First Period: ", observation_df.shape)
-    print("Second Period: ", test_df.shape)
+    # Materialize the activity matrix once and work on its rows
+    activity = df.to_numpy()
     
     feature_names = [
         "activity_ratio",
@@ -237,27 +150,20 @@ def process_all_users(df):
         "recent_activity_density"
     ]
     
-    # Initialize empty dataframes
-    features_data = []
-    dormancy_data = []
-    
-    user_ids = df.get_column(df.columns[0]).to_list()  # assuming first column contains user_ids
+    # Periodicity scores of every user from blocked FFTs
+    periodicity = activity_periodicity_scores(activity)
     
-    for user_id in user_ids:
-        # Calculate dormancy
-        dormancy_value = calculate_dormancy(observation_df, user_id, get_rfi_matrix)
-        dormancy_data.append({"user_id": user_id, "6_months_dormancy": int(dormancy_value)})
-        
-        # Calculate features
-        _, features = get_rfi_matrix(df, user_id)
-        feature_row = {"user_id": user_id}
-        for i, feature_name in enumerate(feature_names):
-            feature_row[feature_name] = features[i] if i < len(features) else 0
-        features_data.append(feature_row)
+    # All features of every user, and their dormancy over the observation period (first days
+    # of the same rows), from one parallel kernel with a single episode scan per row
+    features, dormancy = compute_row_features(activity, periodicity, first_period_duration)
     
-    # Create polars dataframes
-    features_df = pl.DataFrame(features_data)
-    dormancy_df = pl.DataFrame(dormancy_data)
+    # Users are identified by their row index, as in the rest of the app
+    user_ids = np.arange(activity.shape[0])
+    features_df = pl.DataFrame({
+        "user_id": user_ids,
+        **{feature_name: features[:, i] for i, feature_name in enumerate(feature_names)}
+    })
+    dormancy_df = pl.DataFrame({"user_id": user_ids, "6_months_dormancy": dormancy.astype(np.int64)})
     
     # Rename feature columns
     features_df = features_df.rename({
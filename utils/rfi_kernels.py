@@ -0,0 +1,317 @@
+import numpy as np
+from numba import njit, prange
+from numba.cpython.unsafe.numbers import trailing_zeros
+
+# SWAR popcount masks
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+_ONE = np.uint64(1)
+_ALL = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# Relevance decay rate over the square root of recency
+_K = 1 / 30
+
+
+def pack_activity(arr):
+    """Pack a 0/1 activity matrix (any integer dtype) into uint64 words, bit d of a row holding day d"""
+    n_users, n_days = arr.shape
+    n_words = (n_days + 63) // 64
+    packed = np.zeros((n_users, n_words * 8), dtype=np.uint8)
+    packed[:, :(n_days + 7) // 8] = np.packbits(arr, axis=1, bitorder="little")
+    return packed.view("<u8")
+
+
+@njit
+def _popcount(x):
+    """Number of set bits in a uint64 word"""
+    x = x - ((x >> _ONE) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return np.int64((x * _H01) >> np.uint64(56))
+
+
+@njit
+def _next_day(words, pos, n_days, active):
+    """First day at or after pos that is active (or inactive), n_days if there is none"""
+    while pos < n_days:
+        w = pos >> 6
+        word = words[w] if active else words[w] ^ _ALL
+        word = word >> np.uint64(pos & 63)
+        if word != 0:
+            return min(pos + np.int64(trailing_zeros(word)), n_days)
+        pos = (w + 1) << 6
+    return n_days
+
+
+@njit(cache=True)
+def find_episodes(observation_days):
+    """Start and duration of every run of inactive days in an activity row"""
+    n_days = observation_days.shape[0]
+    # A row holds at most n_days // 2 + 1 separate runs
+    starts = np.empty(n_days // 2 + 1, dtype=np.int64)
+    durations = np.empty(n_days // 2 + 1, dtype=np.int64)
+
+    n = 0
+    i = 0
+    while i < n_days:
+        if observation_days[i] == 0:
+            start = i
+            while i < n_days and observation_days[i] == 0:
+                i += 1
+            starts[n] = start
+            durations[n] = i - start
+            n += 1
+        else:
+            i += 1
+    return starts[:n], durations[:n]
+
+
+@njit
+def _record_episode(frequency, min_recency, duration, recency):
+    """Add an episode to the RFI rows indexed by duration: frequency and most recent occurrence"""
+    frequency[duration] += 1
+    if recency < min_recency[duration]:
+        min_recency[duration] = recency
+
+
+@njit
+def _add_moments(moments, duration, recency):
+    """Accumulate the exact integer moments (n, ΣI, ΣR, ΣI², ΣR², ΣRI) of an episode"""
+    moments[0] += 1
+    moments[1] += duration
+    moments[2] += recency
+    moments[3] += duration * duration
+    moments[4] += recency * recency
+    moments[5] += duration * recency
+
+
+@njit
+def _linearity(moments):
+    """Inactivity Linearity: R² of episode durations against recencies from their moments"""
+    n = moments[0]
+    sum_I = moments[1]
+    sum_R = moments[2]
+    sum_II = moments[3]
+    sum_RR = moments[4]
+    sum_RI = moments[5]
+    if n > 1:
+        var_I = n * sum_II - sum_I * sum_I
+        var_R = n * sum_RR - sum_R * sum_R
+        if var_I > 0 and var_R > 0:
+            cov = float(n * sum_RI - sum_I * sum_R)
+            return min(cov * cov / (float(var_I) * float(var_R)), 1.0)
+    return 0.0
+
+
+@njit
+def _reduce_rfi_rows(frequency, min_recency, max_duration):
+    """Row count, total and lowest recency, total and maximum relevance, and relevance-weighted
+    duration of the RFI rows indexed by duration"""
+    n_rows = 0
+    total_R = 0
+    lowest_R = max_duration + 1
+    total_relevance = 0.0
+    max_relevance = 0.0
+    weighted_I = 0.0
+    for I in range(1, max_duration + 1):
+        F = frequency[I]
+        if F > 0:
+            R = min_recency[I]
+            n_rows += 1
+            total_R += R
+            lowest_R = min(lowest_R, R)
+            if R < 90:
+                relevance = round(I * F * np.exp(-_K * np.sqrt(R + 1)), 2)
+                total_relevance += relevance
+                max_relevance = max(max_relevance, relevance)
+                weighted_I += I * relevance
+    return n_rows, total_R, lowest_R, total_relevance, max_relevance, weighted_I
+
+
+@njit
+def _dormancy(frequency, min_recency, max_duration):
+    """Dormancy: relevance-weighted average of episode durations"""
+    _, _, _, total_relevance, _, weighted_I = _reduce_rfi_rows(frequency, min_recency, max_duration)
+    if total_relevance > 0:
+        return np.round(weighted_I / total_relevance)
+    return 0.0
+
+
+@njit(parallel=True, cache=True)
+def popcount_rows(packed):
+    """Number of active days in every row of a packed activity matrix"""
+    n_users, n_words = packed.shape
+    counts = np.zeros(n_users, dtype=np.int64)
+    for u in prange(n_users):
+        total = 0
+        for w in range(n_words):
+            total += _popcount(packed[u, w])
+        counts[u] = total
+    return counts
+
+
+@njit(parallel=True, cache=True)
+def popcount_columns(packed, n_days):
+    """Number of active rows for every day of a packed activity matrix"""
+    n_users, n_words = packed.shape
+    counts = np.zeros(n_words * 64, dtype=np.int64)
+    # Each word column owns 64 distinct days, so word columns can be counted in parallel
+    for w in prange(n_words):
+        for u in range(n_users):
+            word = packed[u, w]
+            while word != 0:
+                counts[(w << 6) + np.int64(trailing_zeros(word))] += 1
+                word &= word - _ONE
+    return counts[:n_days]
+
+
+@njit(parallel=True, cache=True, fastmath=True)
+def compute_features(packed, n_days):
+    """Compute activity ratio, inactivity linearity and dormancy for every row of a packed activity matrix"""
+    n_users, n_words = packed.shape
+
+    activity_ratio = np.zeros(n_users, dtype=np.float64)
+    inactivity_linearity = np.zeros(n_users, dtype=np.float64)
+    dormancy = np.zeros(n_users, dtype=np.float64)
+
+    for u in prange(n_users):
+        words = packed[u]
+        last = n_days - 1
+        reference_day = np.int64((words[last >> 6] >> np.uint64(last & 63)) & _ONE)
+
+        active = 0
+        for w in range(n_words):
+            active += _popcount(words[w])
+
+        # RFI rows indexed by duration: frequency and most recent occurrence
+        frequency = np.zeros(n_days + 1, dtype=np.int64)
+        min_recency = np.full(n_days + 1, n_days + 1, dtype=np.int64)
+        moments = np.zeros(6, dtype=np.int64)
+
+        # Jump from run to run with bit scans: a run of zeros closed by an active day
+        # is a previous episode; a run still open at the end is the ongoing episode
+        start = _next_day(words, 0, n_days, False)
+        while start < n_days:
+            end = _next_day(words, start, n_days, True)
+            if end < n_days:
+                _record_episode(frequency, min_recency, end - start, n_days - end)
+                _add_moments(moments, end - start, n_days - end)
+            start = _next_day(words, end, n_days, False)
+
+        # Activity Ratio: observation days exclude the reference day,
+        # extended by one inactive day if inactive today
+        total_days = n_days if reference_day == 0 else n_days - 1
+        if total_days > 0:
+            activity_ratio[u] = (active - reference_day) / total_days
+
+        inactivity_linearity[u] = _linearity(moments)
+        dormancy[u] = _dormancy(frequency, min_recency, n_days)
+
+    return activity_ratio, inactivity_linearity, dormancy
+
+
+@njit(parallel=True, cache=True)
+def compute_row_features(activity, periodicity, window):
+    """Compute the eleven RFI features of every row of an activity matrix, and the dormancy of its
+    first window days, from one linear scan per row"""
+    n_users, n_days = activity.shape
+    n_obs = n_days - 1
+    window = min(window, n_days)
+
+    features = np.zeros((n_users, 11), dtype=np.float64)
+    dormancy = np.zeros(n_users, dtype=np.float64)
+
+    for u in prange(n_users):
+        row = activity[u]
+        reference_day = row[n_obs]
+        # Observation days exclude the reference day, extended by one inactive day if inactive today
+        length = n_obs + 1 if reference_day == 0 else n_obs
+        recent_window = min(30, length)
+        recency_offset = 1 if reference_day == 0 else 0
+
+        # RFI rows indexed by duration: frequency and most recent occurrence
+        frequency = np.zeros(length + 1, dtype=np.int64)
+        min_recency = np.full(length + 1, length + 1, dtype=np.int64)
+        # Same for the episodes closed within the window, with recency relative to its last day
+        window_frequency = np.zeros(window + 1, dtype=np.int64)
+        window_min_recency = np.full(window + 1, window + 1, dtype=np.int64)
+
+        active = 0
+        recent_active = 0
+        last_active = -1
+        n_gaps = 0
+        gap_mean = 0.0
+        gap_m2 = 0.0
+
+        moments = np.zeros(6, dtype=np.int64)
+        growth_sum = 0.0
+        prev_duration = 0
+
+        # Single pass over the days; day == length closes a trailing run when active today
+        run_start = -1
+        for d in range(length + 1):
+            if d < length and (d >= n_obs or row[d] == 0):
+                if run_start < 0:
+                    run_start = d
+                continue
+
+            if d < length:
+                active += 1
+                if d >= length - recent_window:
+                    recent_active += 1
+                # Welford update of the gaps between active days
+                if last_active >= 0:
+                    n_gaps += 1
+                    delta = (d - last_active) - gap_mean
+                    gap_mean += delta / n_gaps
+                    gap_m2 += delta * ((d - last_active) - gap_mean)
+                last_active = d
+
+            # A run of inactive days closed by an active day is a previous episode
+            if run_start >= 0 and (d < length or reference_day != 0):
+                duration = d - run_start
+                recency = length - (d - 1) - recency_offset
+                _record_episode(frequency, min_recency, duration, recency)
+                if moments[0] > 0:
+                    growth_sum += duration / prev_duration
+                prev_duration = duration
+                _add_moments(moments, duration, recency)
+                if d <= window - 1:
+                    _record_episode(window_frequency, window_min_recency, duration, window - d)
+                run_start = -1
+
+        # A run still open at the end is the ongoing episode (its own row, recency 0)
+        ongoing = length - run_start if run_start >= 0 else 0
+
+        # Dormancy over the episodes closed within the window
+        dormancy[u] = _dormancy(window_frequency, window_min_recency, window)
+
+        n_prev = moments[0]
+        if length > 0:
+            features[u, 0] = active / length
+        if n_prev == 0 and ongoing == 0:
+            continue
+
+        n_rows, total_R, lowest_R, total_relevance, max_relevance, _ = _reduce_rfi_rows(
+            frequency, min_recency, length)
+        if ongoing > 0:
+            n_rows += 1
+            lowest_R = 0
+
+        features[u, 1] = n_prev + (1 if ongoing > 0 else 0)
+        features[u, 2] = total_R / n_rows
+        features[u, 3] = lowest_R
+        features[u, 4] = total_relevance / n_rows
+        features[u, 5] = max_relevance
+        features[u, 6] = periodicity[u]
+        features[u, 7] = _linearity(moments)
+
+        if n_gaps > 0:
+            features[u, 8] = np.sqrt(gap_m2 / n_gaps)
+        features[u, 9] = growth_sum / (n_prev - 1) if n_prev > 1 else 1.0
+        if recent_window > 0:
+            features[u, 10] = recent_active / recent_window
+
+    return features, dormancy
@@ -1,139 +1,135 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
+import altair as alt
+import numpy as np
 import pandas as pd
-import polars as pl
 import streamlit as st
 
 
-def plot_daily_active_users(pivot_df):
+def get_activity_aggregates(pivot_df):
+    """Compute the per-day and per-user activity aggregates shared by the visualizations"""
+    try:
+        # Bit-packing loads Numba, so it is deferred until the visualizations are first needed
+        from utils.rfi_kernels import pack_activity, popcount_columns, popcount_rows
+
+        # Pack 64 days per word once; both reductions then run on popcounts over the packed words
+        n_days = pivot_df.width
+        # packbits takes the Int16 matrix as is (any non-zero is a set bit), so no uint8 copy is made
+        packed = pack_activity(pivot_df.to_numpy())
+        daily_active = popcount_columns(packed, n_days)
+        active_days = popcount_rows(packed)
+
+        # 7-day rolling average derived from the daily counts via cumulative sums
+        cumulative = np.concatenate(([0], np.cumsum(daily_active)))
+        weekly_active = np.full(daily_active.shape[0], np.nan)
+        weekly_active[6:] = (cumulative[7:] - cumulative[:-7]) / 7
+
+        aggregates = {
+            'dates': np.array(pivot_df.columns, dtype='datetime64[D]'),
+            'daily_active': daily_active,
+            'weekly_active': weekly_active,
+            'active_days': active_days
+        }
+        return aggregates, None
+    except Exception as e:
+        return None, str(e)
+
+
+@st.cache_data(show_spinner=False)
+def plot_daily_active_users(dates, daily_active):
     """Plot daily active users over time"""
     try:
-        # Convert to pandas for plotting
-        if isinstance(pivot_df, pl.DataFrame):
-            pivot_pandas = pivot_df.to_pandas()
-        else:
-            pivot_pandas = pivot_df
-            
-        daily_active_users = pivot_pandas.sum(axis=0)
-        
         daily_active_df = pd.DataFrame({
-            'Date': daily_active_users.index,
-            'Active_Users': daily_active_users.values
+            'Date': dates,
+            'Active_Users': daily_active
         })
-        
-        daily_active_df['Date'] = pd.to_datetime(daily_active_df['Date'])
-        
-        fig, ax = plt.subplots(figsize=(12, 5))
-        sns.lineplot(data=daily_active_df, x='Date', y='Active_Users', ax=ax)
-        ax.set_title('Daily Active Users Over Time')
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Number of Active Users')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
-        return fig
+
+        chart = alt.Chart(daily_active_df).mark_line().encode(
+            x=alt.X('Date:T', title='Date'),
+            y=alt.Y('Active_Users:Q', title='Number of Active Users')
+        ).properties(title='Daily Active Users Over Time', height=400)
+
+        return chart
     except Exception as e:
         st.error(f"Error plotting daily active users: {str(e)}")
         return None
 
 
-def plot_weekly_active_users(pivot_df):
+@st.cache_data(show_spinner=False)
+def plot_weekly_active_users(dates, weekly_active):
     """Plot weekly active users (7-day rolling average)"""
     try:
-        # Convert to pandas for plotting
-        if isinstance(pivot_df, pl.DataFrame):
-            pivot_pandas = pivot_df.to_pandas()
-        else:
-            pivot_pandas = pivot_df
-            
-        daily_active_users = pivot_pandas.sum(axis=0)
-        
-        daily_active_df = pd.DataFrame({
-            'Date': daily_active_users.index,
-            'Active_Users': daily_active_users.values
+        weekly_active_df = pd.DataFrame({
+            'Date': dates,
+            'Weekly_Active_Users': weekly_active
         })
-        
-        daily_active_df['Date'] = pd.to_datetime(daily_active_df['Date'])
-        daily_active_df['Weekly_Active_Users'] = daily_active_df['Active_Users'].rolling(window=7).mean()
-        
-        fig, ax = plt.subplots(figsize=(12, 5))
-        sns.lineplot(data=daily_active_df, x='Date', y='Weekly_Active_Users', ax=ax)
-        ax.set_title('Weekly Active Users (7-Day Rolling Average) Over Time')
-        ax.set_xlabel('Date')
-        ax.set_ylabel('Number of Active Users (7-Day Rolling Average)')
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
-        return fig
+
+        chart = alt.Chart(weekly_active_df).mark_line().encode(
+            x=alt.X('Date:T', title='Date'),
+            y=alt.Y('Weekly_Active_Users:Q', title='Number of Active Users (7-Day Rolling Average)')
+        ).properties(title='Weekly Active Users (7-Day Rolling Average) Over Time', height=400)
+
+        return chart
     except Exception as e:
         st.error(f"Error plotting weekly active users: {str(e)}")
         return None
 
 
-def plot_active_days_distribution(pivot_df):
+def _count_values(values, column):
+    """Count occurrences of each non-negative integer value, keeping only the values that occur"""
+    counts = np.bincount(np.asarray(values, dtype=np.int64))
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({column: present, 'Users': counts[present]})
+
+
+@st.cache_data(show_spinner=False)
+def plot_active_days_distribution(active_days):
     """Plot distribution of active days per user"""
     try:
-        # Convert to pandas for plotting
-        if isinstance(pivot_df, pl.DataFrame):
-            pivot_pandas = pivot_df.to_pandas()
-        else:
-            pivot_pandas = pivot_df
-            
-        active_days_per_user = pivot_pandas.sum(axis=1)
-        
-        fig, ax = plt.subplots(figsize=(8, 4))
-        sns.histplot(active_days_per_user, bins=25, kde=True, ax=ax)
-        ax.set_title('Distribution of Active Days Per User')
-        ax.set_xlabel('Number of Active Days')
-        ax.set_ylabel('Number of Users')
-        plt.tight_layout()
-        
-        return fig
+        # Ship per-value counts instead of one row per user; the chart only re-bins them
+        counts_df = _count_values(active_days, 'Active_Days')
+
+        chart = alt.Chart(counts_df).mark_bar().encode(
+            x=alt.X('Active_Days:Q', bin=alt.Bin(maxbins=25), title='Number of Active Days'),
+            y=alt.Y('sum(Users):Q', title='Number of Users')
+        ).properties(title='Distribution of Active Days Per User', height=300)
+
+        return chart
     except Exception as e:
         st.error(f"Error plotting active days distribution: {str(e)}")
         return None
 
 
+@st.cache_data(show_spinner=False)
 def plot_inactivity_streaks_distribution(streaks_df):
     """Plot distribution of longest inactivity streaks"""
     try:
-        fig, ax = plt.subplots(figsize=(8, 4))
-        sns.histplot(streaks_df["Longest_Inactivity_Streak"], bins=10, kde=True, ax=ax)
-        ax.set_title('Distribution of Longest Inactivity Streaks Per User')
-        ax.set_xlabel('Longest Inactivity Streak (Days)')
-        ax.set_ylabel('Number of Users')
-        plt.tight_layout()
-        
-        return fig
+        counts_df = _count_values(streaks_df['Longest_Inactivity_Streak'], 'Longest_Inactivity_Streak')
+
+        chart = alt.Chart(counts_df).mark_bar().encode(
+            x=alt.X('Longest_Inactivity_Streak:Q', bin=alt.Bin(maxbins=10), title='Longest Inactivity Streak (Days)'),
+            y=alt.Y('sum(Users):Q', title='Number of Users')
+        ).properties(title='Distribution of Longest Inactivity Streaks Per User', height=300)
+
+        return chart
     except Exception as e:
         st.error(f"Error plotting inactivity streaks: {str(e)}")
         return None
 
 
-def plot_activity_pattern(pivot_df, user_id):
+@st.cache_data(show_spinner=False)
+def plot_activity_pattern(user_activity, user_id):
     """Plot activity pattern for a specific user"""
     try:
-        # Convert to pandas for plotting
-        if isinstance(pivot_df, pl.DataFrame):
-            pivot_pandas = pivot_df.to_pandas()
-        else:
-            pivot_pandas = pivot_df
-            
-        if user_id >= len(pivot_pandas):
-            st.error(f"User ID {user_id} not found. Available range: 0 to {len(pivot_pandas)-1}")
-            return None
-            
-        user_activity = pivot_pandas.iloc[user_id]
-        
-        fig, ax = plt.subplots(figsize=(12, 3))
-        sns.heatmap([user_activity], cmap="Blues", cbar=False, 
-                   xticklabels=False, yticklabels=[f"User {user_id}"], ax=ax)
-        ax.set_title(f"Activity Pattern for User {user_id}")
-        ax.set_xlabel("Time (Days)")
-        ax.set_ylabel("Activity")
-        plt.tight_layout()
-        
-        return fig
+        chart = alt.Chart(pd.DataFrame({
+            'Day': range(len(user_activity)),
+            'Active': user_activity
+        })).mark_rect().encode(
+            x=alt.X('Day:O', title='Time (Days)', axis=alt.Axis(labels=False, ticks=False)),
+            y=alt.value(0),
+            y2=alt.value(60),
+            color=alt.Color('Active:Q', scale=alt.Scale(scheme='blues'), legend=None)
+        ).properties(title=f"Activity Pattern for User {user_id}", height=60)
+
+        return chart
     except Exception as e:
         st.error(f"Error plotting activity pattern: {str(e)}")
-        return None
\ No newline at end of file
+        return None